@@ -0,0 +1,387 @@
+"""Shared runtime for the rendered git guard hooks.
+
+The hook scripts written into ``.git/hooks`` delegate here when the
+``mcp_agent_mail`` package is importable from the hook's interpreter, so the
+conflict-detection logic runs from normal bytecode-cached module code and
+fixes ship without reinstalling hooks. Each script keeps a fully inlined
+copy of this logic as a fallback for repos whose hook interpreter cannot see
+the package, which is why this module must stay dependency-light: stdlib
+only, plus the same optional pathspec/orjson accelerators the inline body
+probes for.
+"""
+
+from __future__ import annotations
+
+import bisect
+import fnmatch as _fn
+import os
+import re
+import subprocess
+import sys
+from collections.abc import Iterable, Iterator, Sequence
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:  # Optional Git pathspec support (preferred when available)
+    from pathspec import PathSpec as _PS  # type: ignore[import-not-found]
+    from pathspec.patterns.gitwildmatch import GitWildMatchPattern as _GWM  # type: ignore[import-not-found]
+except Exception:  # pragma: no cover - depends on hook environment
+    _PS = None  # type: ignore[assignment]
+    _GWM = None  # type: ignore[assignment]
+
+try:  # Optional orjson accelerator; both decoders accept bytes
+    from orjson import loads as _loads  # type: ignore[import-not-found]
+except Exception:  # pragma: no cover - depends on hook environment
+    from json import loads as _loads
+
+_TRUTHY = {"1", "true", "t", "yes", "y"}
+
+
+def _gate_enabled() -> bool:
+    gate = os.environ.get("WORKTREES_ENABLED", "0") or os.environ.get("GIT_IDENTITY_ENABLED", "0") or "0"
+    return gate.strip().lower() in _TRUTHY
+
+
+def _advisory_mode() -> bool:
+    mode = (os.environ.get("AGENT_MAIL_GUARD_MODE", "block") or "block").strip().lower()
+    return mode in {"warn", "advisory", "adv"}
+
+
+def _bypass_enabled() -> bool:
+    return (os.environ.get("AGENT_MAIL_BYPASS", "0") or "0").strip().lower() in _TRUTHY
+
+
+def _not_expired(expires_ts: str, now_iso: str) -> bool:
+    # Canonical ISO-8601 UTC timestamps compare chronologically as strings,
+    # so expiry checks avoid constructing a datetime per reservation.
+    if not expires_ts:
+        return True
+    try:
+        if len(expires_ts) >= 20 and expires_ts[4] == "-":
+            return expires_ts > now_iso
+        return datetime.fromisoformat(expires_ts) > datetime.now(timezone.utc)
+    except Exception:
+        return True
+
+
+def _iter_raw_records(reservations_dir: Path, manifest: Path) -> Iterator[object]:
+    # Prefer the concatenated manifest (one open + parse); fall back to the
+    # per-reservation JSON scan for archives written before the manifest existed.
+    try:
+        raw = manifest.read_bytes()
+    except Exception:
+        raw = None
+    if raw is not None:
+        for line in raw.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield _loads(line)
+            except Exception:
+                continue
+        return
+    try:
+        entries = os.scandir(str(reservations_dir))
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if not entry.name.endswith(".json") or not entry.is_file():
+                continue
+            try:
+                # Bare open() on the scandir string path: no Path object per file.
+                with open(entry.path, "rb") as fh:  # noqa: PTH123
+                    data = _loads(fh.read())
+            except Exception:
+                continue
+            recs = data if isinstance(data, list) else [data]
+            yield from recs
+
+
+def load_file_reservations(reservations_dir: Path, manifest: Path, agent_name: str) -> Iterator[tuple[str, str]]:
+    """Yield (pattern, holder) for active exclusive reservations held by other agents."""
+
+    now_iso = datetime.now(timezone.utc).isoformat()
+    for r in _iter_raw_records(reservations_dir, manifest):
+        if not isinstance(r, dict):
+            continue
+        patt = (r.get("path_pattern") or "").strip()
+        if not patt:
+            continue
+        holder = (r.get("agent") or "").strip()
+        if not r.get("exclusive", True):
+            continue
+        if holder and holder == agent_name:
+            continue
+        if not _not_expired((r.get("expires_ts") or "").strip(), now_iso):
+            continue
+        yield patt, holder
+
+
+def _load_db_reservations(db_path: str, project_slug: str, agent_name: str) -> list[tuple[str, str]] | None:
+    """Read active foreign reservations straight from the server database.
+
+    Returns None when the database is missing or unreadable so the caller
+    can fall back to the JSON artifacts; an empty list is an authoritative
+    "no reservations" answer. Opened read-only so a hook can never create
+    or lock the database.
+    """
+
+    if not db_path or not project_slug or not Path(db_path).exists():
+        return None
+    import sqlite3
+
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=2.0)
+        try:
+            rows = conn.execute(
+                "SELECT fr.path_pattern, a.name FROM file_reservations fr"
+                " JOIN agents a ON a.id = fr.agent_id"
+                " JOIN projects p ON p.id = fr.project_id"
+                " WHERE p.slug = ? AND fr.exclusive = 1"
+                " AND fr.released_ts IS NULL AND fr.expires_ts > ?",
+                (project_slug, now),
+            ).fetchall()
+        finally:
+            conn.close()
+    except Exception:
+        return None
+    return [(patt, holder or "") for patt, holder in rows if not (holder and holder == agent_name)]
+
+
+def _compile_spec(active: Sequence[tuple[str, str]]):
+    # Union every pattern into a single compiled PathSpec; check_file()
+    # reports the matching pattern index for conflict attribution.
+    if not (_PS and _GWM):
+        return None
+    try:
+        spec = _PS.from_lines(_GWM, [patt.replace("\\", "/") for patt, _holder in active])
+    except Exception:
+        return None
+    return spec if hasattr(spec, "check_file") else None
+
+
+def _build_fallback_matcher(active: Sequence[tuple[str, str]]):
+    # Literal patterns become an O(1) dict probe and the common
+    # '*suffix' / 'prefix*' shapes use str.endswith/startswith instead of
+    # a regex; remaining wildcard patterns with a literal prefix are
+    # bucketed so each path only tests plausible candidates; prefix-less
+    # patterns share one unioned regex.
+    literals: dict[str, int] = {}
+    suffixes: list[tuple[str, int]] = []
+    buckets: dict[str, list[tuple[re.Pattern[str] | None, int]]] = {}
+    free_parts: list[str] = []
+    for idx, (patt, _holder) in enumerate(active):
+        q = patt.replace("\\", "/").lstrip("/")
+        if not any(c in q for c in "*?["):
+            literals.setdefault(q, idx)
+            continue
+        if q.startswith("*") and not any(c in q[1:] for c in "*?["):
+            suffixes.append((q[1:], idx))
+            continue
+        prefix = re.split(r"[*?\[]", q, maxsplit=1)[0]
+        if prefix:
+            # A bare 'prefix*' needs no regex: startswith covers it.
+            rx = None if q == prefix + "*" else re.compile(_fn.translate(q))
+            buckets.setdefault(prefix, []).append((rx, idx))
+        else:
+            free_parts.append(f"(?P<g{idx}>{_fn.translate(q)})")
+    free_rx = re.compile("|".join(free_parts)) if free_parts else None
+    return literals, suffixes, sorted(buckets), buckets, free_rx
+
+
+def _fallback_match(norm, literals, suffixes, prefixes, buckets, free_rx):
+    idx = literals.get(norm)
+    if idx is not None:
+        return idx
+    pos = bisect.bisect_right(prefixes, norm)
+    for j in range(pos - 1, -1, -1):
+        prefix = prefixes[j]
+        if prefix[:1] != norm[:1]:
+            # sorted prefixes: nothing earlier can share the first character
+            break
+        if norm.startswith(prefix):
+            for rx, idx in buckets[prefix]:
+                if rx is None or rx.match(norm):
+                    return idx
+    for suffix, idx in suffixes:
+        if norm.endswith(suffix):
+            return idx
+    if free_rx is not None:
+        m = free_rx.match(norm)
+        if m and m.lastgroup:
+            return int(m.lastgroup[1:])
+    return None
+
+
+def find_conflicts(
+    candidates: Iterable[str],
+    reservations: Sequence[tuple[str, str]],
+) -> list[tuple[str, str, str]]:
+    """Return (pattern, path, holder) triples for candidate paths hitting reservations."""
+
+    conflicts: list[tuple[str, str, str]] = []
+    try:
+        if reservations:
+            spec = _compile_spec(reservations)
+            if spec is not None:
+                for p in candidates:
+                    norm = p.replace("\\", "/").lstrip("/")
+                    result = spec.check_file(norm)
+                    if result.include:
+                        patt, holder = reservations[result.index]
+                        conflicts.append((patt, p, holder))
+            else:
+                literals, suffixes, prefixes, buckets, free_rx = _build_fallback_matcher(reservations)
+                for p in candidates:
+                    norm = p.replace("\\", "/").lstrip("/")
+                    idx = _fallback_match(norm, literals, suffixes, prefixes, buckets, free_rx)
+                    if idx is not None:
+                        patt, holder = reservations[idx]
+                        conflicts.append((patt, p, holder))
+    except Exception:
+        conflicts = []
+    return conflicts
+
+
+def _staged_paths() -> list[str]:
+    # Collect staged paths from one name-status scan, expanding renames (old+new).
+    paths: list[str] = []
+    try:
+        cs = subprocess.run(
+            ["git", "diff", "--cached", "--name-status", "-M", "-z", "--diff-filter=ACMRDTU"],
+            check=True,
+            capture_output=True,
+        )
+        sdata = cs.stdout.decode("utf-8", "ignore")
+        parts = [x for x in sdata.split("\x00") if x]
+        i = 0
+        while i < len(parts):
+            status = parts[i]
+            i += 1
+            if status.startswith("R") and i + 1 < len(parts):
+                oldp = parts[i]
+                newp = parts[i + 1]
+                i += 2
+                if oldp:
+                    paths.append(oldp)
+                if newp:
+                    paths.append(newp)
+            elif i < len(parts):
+                pth = parts[i]
+                i += 1
+                if pth:
+                    paths.append(pth)
+    except Exception:
+        pass
+    return paths
+
+
+def _pushed_paths(argv: Sequence[str], stdin_text: str) -> list[str]:
+    # Read tuples from STDIN: <local ref> <local sha> <remote ref> <remote sha>
+    tuples = []
+    for line in stdin_text.splitlines():
+        parts = line.strip().split()
+        if len(parts) >= 4:
+            tuples.append((parts[0], parts[1], parts[2], parts[3]))
+
+    changed: list[str] = []
+    commits: list[str] = []
+    for _local_ref, local_sha, _remote_ref, remote_sha in tuples:
+        if not local_sha:
+            continue
+        # Enumerate commits to be pushed using remote name from args when available
+        remote = argv[0] if argv else "origin"
+        try:
+            cp = subprocess.run(
+                ["git", "rev-list", "--topo-order", local_sha, "--not", f"--remotes={remote}"],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            for sha in cp.stdout.splitlines():
+                if sha:
+                    commits.append(sha.strip())
+        except Exception:
+            # Fallback: gather changed paths directly when range enumeration fails
+            rng = local_sha if (not remote_sha or set(remote_sha) == {"0"}) else f"{remote_sha}..{local_sha}"
+            try:
+                cp = subprocess.run(["git", "diff", "--name-only", rng], check=True, capture_output=True, text=True)
+                for p in cp.stdout.splitlines():
+                    if p:
+                        changed.append(p.strip())
+            except Exception:
+                pass
+
+    # --stdin lets one diff-tree process cover the whole push range.
+    if commits:
+        try:
+            cp = subprocess.run(
+                ["git", "diff-tree", "--stdin", "-r", "--no-commit-id", "--name-only", "--no-ext-diff", "--diff-filter=ACMRDTU", "-z"],
+                input="\n".join(commits).encode(),
+                check=True,
+                capture_output=True,
+            )
+            data = cp.stdout.decode("utf-8", "ignore")
+            changed.extend(p for p in data.split("\x00") if p)
+        except Exception:
+            pass
+    return changed
+
+
+def main(
+    hook_name: str,
+    reservations_dir: str,
+    manifest: str,
+    argv: Sequence[str] = (),
+    *,
+    db_path: str | None = None,
+    project_slug: str | None = None,
+) -> int:
+    """Run the guard for ``hook_name`` and return its exit code."""
+
+    if not _gate_enabled():
+        return 0
+    if _bypass_enabled():
+        sys.stderr.write(f"[{hook_name}] bypass enabled via AGENT_MAIL_BYPASS=1\n")
+        return 0
+    agent_name = os.environ.get("AGENT_NAME")
+    if not agent_name:
+        sys.stderr.write(f"[{hook_name}] AGENT_NAME environment variable is required.\n")
+        return 1
+
+    # Load reservations before touching git: when no other agent holds an
+    # active exclusive reservation the hook exits without spawning a single
+    # git subprocess, which is the common case on most commits and pushes.
+    # The server database is authoritative when present; the JSON artifacts
+    # cover hooks whose database has moved or never existed.
+    res_dir = Path(reservations_dir)
+    manifest_path = Path(manifest)
+    reservations = None
+    if db_path:
+        reservations = _load_db_reservations(db_path, project_slug or "", agent_name)
+    if reservations is None:
+        reservations = list(load_file_reservations(res_dir, manifest_path, agent_name))
+    if not reservations:
+        return 0
+
+    candidates = _pushed_paths(argv, sys.stdin.read()) if hook_name == "pre-push" else _staged_paths()
+    if not candidates:
+        return 0
+
+    conflicts = find_conflicts(candidates, reservations)
+    if conflicts:
+        sys.stderr.write("Exclusive file_reservation conflicts detected\n")
+        for patt, path, holder in conflicts[:10]:
+            sys.stderr.write(f"- {path} matches {patt} (holder: {holder})\n")
+        if _advisory_mode():
+            return 0
+        return 1
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover - exercised via rendered hooks
+    _hook, _dir, _manifest, *_rest = sys.argv[1:]
+    sys.exit(main(_hook, _dir, _manifest, _rest))
@@ -2839,8 +2839,52 @@ async def _update_recipient_timestamp(
     return now
 
 
+async def _get_product_by_key(session, key: str) -> Optional[Product]:  # type: ignore[no-untyped-def]
+    # Key may match product_uid or name (case-sensitive by default)
+    stmt = select(Product).where(cast(Any, (Product.product_uid == key) | (Product.name == key)))
+    res = await session.execute(stmt)
+    return res.scalars().first()  # type: ignore[no-any-return]
+
+
+async def _compute_product_resource(key: str) -> dict[str, Any]:
+    """Build the resource://product/{key} payload as a plain dict.
+
+    Internal callers (and tests) use this directly to skip the MCP
+    envelope's JSON encode/decode round-trip; the registered resource
+    handler is a thin wrapper around it.
+    """
+    await ensure_schema()
+    async with get_session() as session:
+        prod = await _get_product_by_key(session, key.strip())
+        if prod is None:
+            raise ToolExecutionError("NOT_FOUND", f"Product '{key}' not found.", recoverable=True)
+        proj_rows = await session.execute(
+            select(Project).join(ProductProjectLink, cast(Any, ProductProjectLink.project_id) == Project.id).where(
+                cast(Any, ProductProjectLink.product_id) == cast(Any, prod.id)
+            )
+        )
+        projects = [
+            {"id": p.id, "slug": p.slug, "human_key": p.human_key, "created_at": _iso(p.created_at)}
+            for p in proj_rows.scalars().all()
+        ]
+        return {
+            "id": prod.id,
+            "product_uid": prod.product_uid,
+            "name": prod.name,
+            "created_at": _iso(prod.created_at),
+            "projects": projects,
+        }
+
+
+@functools.cache
 def build_mcp_server() -> FastMCP:
-    """Create and configure the FastMCP server instance."""
+    """Create and configure the FastMCP server instance.
+
+    Cached for the process lifetime: construction registers every tool,
+    resource, and prompt (including schema generation) and is a pure
+    function of settings. Tests that change settings reset it through
+    reset_database_state(), which clears this cache alongside the engine.
+    """
     settings: Settings = get_settings()
     lifespan = _lifespan_factory(settings)
 
@@ -3158,6 +3202,9 @@ def build_mcp_server() -> FastMCP:
         ident = _resolve_project_identity(human_key)
         payload = _project_to_dict(project)
         payload.update(ident)
+        # Identity resolution computes its own slug under git-based modes;
+        # the documented top-level "slug" is always the project row's.
+        payload["slug"] = project.slug
         return payload
 
     @mcp.tool(name="register_agent")
@@ -6451,12 +6498,8 @@ def build_mcp_server() -> FastMCP:
         }
 
     # --- Product Bus (Phase 2): ensure/link/search/resources ---------------------------------
-
-    async def _get_product_by_key(session, key: str) -> Optional[Product]:  # type: ignore[no-untyped-def]
-        # Key may match product_uid or name (case-sensitive by default)
-        stmt = select(Product).where(cast(Any, (Product.product_uid == key) | (Product.name == key)))
-        res = await session.execute(stmt)
-        return res.scalars().first()  # type: ignore[no-any-return]
+    # (Product lookup and the resource payload builder are module-level:
+    # _get_product_by_key / _compute_product_resource.)
 
     if settings.worktrees_enabled:
         @mcp.tool(name="ensure_product")
@@ -6541,6 +6584,73 @@ def build_mcp_server() -> FastMCP:
         async def products_link_tool(ctx: Context, product_key: str, project_key: str) -> dict[str, Any]:  # type: ignore[misc]
             raise ToolExecutionError("FEATURE_DISABLED", "Product Bus is disabled. Enable WORKTREES_ENABLED to use this tool.")
 
+    if settings.worktrees_enabled:
+        @mcp.tool(name="products_bootstrap")
+        @_instrument_tool("products_bootstrap", cluster=CLUSTER_PRODUCT, capabilities={"product"})
+        async def products_bootstrap_tool(
+            ctx: Context,
+            human_key: str,
+            product_key: Optional[str] = None,
+            name: Optional[str] = None,
+        ) -> dict[str, Any]:
+            """
+            Ensure a product and project exist and are linked, in one transaction.
+
+            Equivalent to ensure_product + ensure_project + products_link, but the
+            three writes share one session and commit once, so the common bootstrap
+            path pays a single durable write instead of three.
+            """
+            await ensure_schema()
+            key_raw = (product_key or name or "").strip()
+            if not key_raw:
+                raise ToolExecutionError("INVALID_ARGUMENT", "Provide product_key or name.")
+            if not Path(human_key).is_absolute():
+                raise ToolExecutionError(
+                    "INVALID_ARGUMENT",
+                    f"human_key must be an absolute directory path, got: '{human_key}'.",
+                )
+            slug = _compute_project_slug(human_key)
+            async with get_session() as session:
+                prod = await _get_product_by_key(session, key_raw)
+                if prod is None:
+                    import uuid as _uuid
+                    import re as _re
+                    uid_pattern = _re.compile(r"^[A-Fa-f0-9]{8,64}$")
+                    if product_key and uid_pattern.fullmatch(product_key.strip()):
+                        uid = product_key.strip().lower()
+                    else:
+                        uid = _uuid.uuid4().hex[:20]
+                    display_name = (name or key_raw).strip()
+                    display_name = " ".join(display_name.split())[:255] or uid
+                    prod = Product(product_uid=uid, name=display_name)
+                    session.add(prod)
+                result = await session.execute(select(Project).where(Project.slug == slug))  # type: ignore[arg-type]
+                project = result.scalars().first()
+                if project is None:
+                    project = Project(slug=slug, human_key=human_key)
+                    session.add(project)
+                # Flush assigns ids for the link row without committing yet.
+                await session.flush()
+                existing = await session.execute(
+                    select(ProductProjectLink).where(
+                        cast(Any, ProductProjectLink.product_id) == cast(Any, prod.id),
+                        cast(Any, ProductProjectLink.project_id) == cast(Any, project.id),
+                    )
+                )
+                if existing.scalars().first() is None:
+                    session.add(ProductProjectLink(product_id=int(cast(int, prod.id)), project_id=int(cast(int, project.id))))
+                await session.commit()
+                payload = {
+                    "product": {"id": prod.id, "product_uid": prod.product_uid, "name": prod.name},
+                    "project": {"id": project.id, "slug": project.slug, "human_key": project.human_key},
+                    "linked": True,
+                }
+            await ensure_archive(settings, slug)
+            return payload
+    else:
+        async def products_bootstrap_tool(ctx: Context, human_key: str, product_key: Optional[str] = None, name: Optional[str] = None) -> dict[str, Any]:  # type: ignore[misc]
+            raise ToolExecutionError("FEATURE_DISABLED", "Product Bus is disabled. Enable WORKTREES_ENABLED to use this tool.")
+
     if settings.worktrees_enabled:
         @mcp.resource("resource://product/{key}", mime_type="application/json")
         def product_resource(key: str) -> dict[str, Any]:
@@ -6568,30 +6678,8 @@ def build_mcp_server() -> FastMCP:
                 if ok:
                     return val
                 raise val
-            async def _load() -> dict[str, Any]:
-                await ensure_schema()
-                async with get_session() as session:
-                    prod = await _get_product_by_key(session, key.strip())
-                    if prod is None:
-                        raise ToolExecutionError("NOT_FOUND", f"Product '{key}' not found.", recoverable=True)
-                    proj_rows = await session.execute(
-                        select(Project).join(ProductProjectLink, cast(Any, ProductProjectLink.project_id) == Project.id).where(
-                            cast(Any, ProductProjectLink.product_id) == cast(Any, prod.id)
-                        )
-                    )
-                    projects = [
-                        {"id": p.id, "slug": p.slug, "human_key": p.human_key, "created_at": _iso(p.created_at)}
-                        for p in proj_rows.scalars().all()
-                    ]
-                    return {
-                        "id": prod.id,
-                        "product_uid": prod.product_uid,
-                        "name": prod.name,
-                        "created_at": _iso(prod.created_at),
-                        "projects": projects,
-                    }
             # Run async in a synchronous resource
-            return _run_coro_sync(_load())  # type: ignore[no-any-return]
+            return _run_coro_sync(_compute_product_resource(key))  # type: ignore[no-any-return]
 
     if settings.worktrees_enabled:
         @mcp.tool(name="search_messages_product")
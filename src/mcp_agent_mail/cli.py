@@ -2466,13 +2466,17 @@ def guard_install(
 
     async def _run() -> tuple[Project, Path]:
         project_record = await _get_project_record(project)
-        hook_path = await install_guard_script(settings, project_record.slug, repo_path)
         if prepush:
+            from .guard import install_guards as _install_guards
+
             try:
-                from .guard import install_prepush_guard as _install_prepush
-                await _install_prepush(settings, project_record.slug, repo_path)
+                installed = await _install_guards(settings, project_record.slug, repo_path)
+                hook_path = installed["pre-commit"]
             except Exception as exc:
                 console.print(f"[yellow]Warning: failed to install pre-push guard: {exc}[/]")
+                hook_path = await install_guard_script(settings, project_record.slug, repo_path)
+        else:
+            hook_path = await install_guard_script(settings, project_record.slug, repo_path)
         return project_record, hook_path
 
     try:
@@ -4,6 +4,7 @@ from __future__ import annotations
 
 import asyncio
 import random
+import sys
 from collections.abc import AsyncIterator, Callable
 from contextlib import asynccontextmanager
 from functools import wraps
@@ -86,8 +87,12 @@ def retry_on_db_lock(max_retries: int = 5, base_delay: float = 0.1, max_delay: f
     return decorator
 
 
-def _build_engine(settings: DatabaseSettings) -> AsyncEngine:
-    """Build async SQLAlchemy engine with SQLite-optimized settings for concurrency."""
+def _build_engine(settings: DatabaseSettings, *, relaxed_durability: bool = False) -> AsyncEngine:
+    """Build async SQLAlchemy engine with SQLite-optimized settings for concurrency.
+
+    relaxed_durability skips fsync on commit (synchronous=OFF) for throwaway
+    databases such as test runs, where losing data on power failure is moot.
+    """
     from sqlalchemy import event
 
     # For SQLite, enable WAL mode and set timeout for better concurrent access
@@ -154,8 +159,14 @@ def _build_engine(settings: DatabaseSettings) -> AsyncEngine:
             cursor = dbapi_conn.cursor()
             # Enable WAL mode for concurrent reads/writes
             cursor.execute("PRAGMA journal_mode=WAL")
-            # Use NORMAL synchronous mode (safer than OFF, faster than FULL)
-            cursor.execute("PRAGMA synchronous=NORMAL")
+            if relaxed_durability:
+                # No fsync and in-memory temp tables: commits become
+                # memory-speed. WAL is kept so concurrency behaves the same.
+                cursor.execute("PRAGMA synchronous=OFF")
+                cursor.execute("PRAGMA temp_store=MEMORY")
+            else:
+                # Use NORMAL synchronous mode (safer than OFF, faster than FULL)
+                cursor.execute("PRAGMA synchronous=NORMAL")
             # Set busy timeout (wait up to 30 seconds for locks)
             cursor.execute("PRAGMA busy_timeout=30000")
             cursor.close()
@@ -169,7 +180,10 @@ def init_engine(settings: Settings | None = None) -> None:
     if _engine is not None and _session_factory is not None:
         return
     resolved_settings = settings or get_settings()
-    engine = _build_engine(resolved_settings.database)
+    engine = _build_engine(
+        resolved_settings.database,
+        relaxed_durability=resolved_settings.environment == "test",
+    )
     _engine = engine
     _session_factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
@@ -232,6 +246,11 @@ def reset_database_state() -> None:
     _session_factory = None
     _schema_ready = False
     _schema_lock = None
+    # The cached MCP server captures settings at build time; drop it together
+    # with the engine. Looked up via sys.modules to avoid a circular import.
+    app_module = sys.modules.get("mcp_agent_mail.app")
+    if app_module is not None:
+        app_module.build_mcp_server.cache_clear()
 
 
 def _setup_fts(connection: Any) -> None:
@@ -287,6 +306,10 @@ def _setup_fts(connection: Any) -> None:
     connection.exec_driver_sql(
         "CREATE INDEX IF NOT EXISTS idx_file_reservations_expires_ts ON file_reservations(expires_ts)"
     )
+    connection.exec_driver_sql(
+        # Serves the git-hook lookup: active reservations for one project.
+        "CREATE INDEX IF NOT EXISTS idx_file_reservations_project_released ON file_reservations(project_id, released_ts)"
+    )
     connection.exec_driver_sql(
         "CREATE INDEX IF NOT EXISTS idx_message_recipients_agent ON message_recipients(agent_id)"
     )
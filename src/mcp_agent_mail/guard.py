@@ -3,8 +3,12 @@
 from __future__ import annotations
 
 import asyncio
+import functools
+import json
 import os
+import string
 import subprocess
+from collections.abc import Callable
 from pathlib import Path
 
 from .config import Settings
@@ -12,6 +16,7 @@ from .storage import ProjectArchive, ensure_archive
 
 __all__ = [
     "install_guard",
+    "install_guards",
     "install_prepush_guard",
     "render_precommit_script",
     "render_prepush_script",
@@ -19,6 +24,62 @@ __all__ = [
 ]
 
 
+def _write_executable(path: Path, content: str) -> None:
+    """Write hook content with the exec bit set at create time.
+
+    Rendered hooks only change when the archive root changes, so an install
+    over identical content (and mode) is a no-op that leaves mtime alone and
+    avoids waking editor/file watchers. os.open(..., 0o755) makes new files
+    executable without a follow-up chmod; the mode only needs correcting when
+    the file pre-existed with other bits.
+    """
+
+    data = content.encode("utf-8")
+    try:
+        if path.read_bytes() == data and path.stat().st_mode & 0o777 == 0o755:
+            return
+    except OSError:
+        pass
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o755)
+    try:
+        os.write(fd, data)
+        if os.fstat(fd).st_mode & 0o777 != 0o755:
+            path.chmod(0o755)
+    finally:
+        os.close(fd)
+
+
+@functools.lru_cache(maxsize=64)
+def _resolve_hooks_dir_cached(repo_path: str) -> Path:
+    """Resolve the active hooks directory for a repo with a single git call.
+
+    ``git rev-parse --git-path hooks`` already honors ``core.hooksPath``
+    (absolute or relative) as well as worktree layouts, so one subprocess
+    replaces the separate config/rev-parse probes each install used to make.
+    Results are memoized per repo path for the life of the process.
+    """
+
+    repo = Path(repo_path)
+    try:
+        cp = subprocess.run(
+            ["git", "-C", str(repo), "rev-parse", "--show-toplevel", "--git-common-dir", "--git-path", "hooks"],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        lines = [line.strip() for line in cp.stdout.splitlines()]
+    except Exception:
+        lines = []
+    if len(lines) >= 3 and lines[2]:
+        hooks = Path(lines[2])
+        if not hooks.is_absolute():
+            # git emits --git-path output relative to its cwd (the repo)
+            hooks = repo / hooks
+        return hooks
+    # Last resort: traditional path
+    return repo / ".git" / "hooks"
+
+
 def _render_chain_runner_script(hook_name: str) -> str:
     """
     Render a Python chain-runner for the given Git hook name.
@@ -99,148 +160,436 @@ def _render_chain_runner_script(hook_name: str) -> str:
     return "\n".join(lines) + "\n"
 
 
+# Minimal header imports: everything needed to delegate to the packaged
+# runtime before the fallback body's heavier imports run.
+_HOOK_HEADER_LINES: tuple[str, ...] = (
+    "import os",
+    "import sys",
+    "from pathlib import Path",
+)
+
+# Delegate to the packaged runtime when its source file still exists: the
+# module is bytecode-cached and logic fixes land without reinstalling hooks.
+# Loaded by file path so the hook never triggers mcp_agent_mail/__init__
+# (which imports the whole server). The rest of the script is the
+# self-contained fallback for when the package installation moved or is gone.
+_HOOK_DELEGATE_LINES: tuple[str, ...] = (
+    "try:",
+    "    import importlib.util as _ilu",
+    "    _spec = _ilu.spec_from_file_location(\"_agent_mail_hookrt\", HOOKRT_PATH)",
+    "    _rt = _ilu.module_from_spec(_spec)",
+    "    _spec.loader.exec_module(_rt)",
+    "except Exception:",
+    "    _rt = None",
+    "if _rt is not None:",
+    "    sys.exit(_rt.main(HOOK_NAME, str(FILE_RESERVATIONS_DIR), str(FILE_RESERVATION_MANIFEST), sys.argv[1:],",
+    "                      db_path=DB_PATH, project_slug=PROJECT_SLUG))",
+)
+
+_HOOK_IMPORT_LINES: tuple[str, ...] = (
+    "import bisect",
+    "import re",
+    "import subprocess",
+    "import fnmatch as _fn",
+    "from datetime import datetime, timezone",
+    "",
+    "# Optional Git pathspec support (preferred when available)",
+    "try:",
+    "    from pathspec import PathSpec as _PS  # type: ignore[import-not-found]",
+    "    from pathspec.patterns.gitwildmatch import GitWildMatchPattern as _GWM  # type: ignore[import-not-found]",
+    "except Exception:",
+    "    _PS = None  # type: ignore[assignment]",
+    "    _GWM = None  # type: ignore[assignment]",
+    "",
+    "# Optional orjson accelerator; both decoders accept bytes",
+    "try:",
+    "    from orjson import loads as _loads  # type: ignore[import-not-found]",
+    "except Exception:",
+    "    from json import loads as _loads",
+)
+
+# Reservation loading + matching shared by the pre-commit and pre-push scripts.
+_HOOK_RESERVATION_LINES: tuple[str, ...] = (
+    "# Local conflict detection against FILE_RESERVATIONS_DIR",
+    "NOW_ISO = datetime.now(timezone.utc).isoformat()",
+    "def _not_expired(expires_ts):",
+    "    # Canonical ISO-8601 UTC timestamps compare chronologically as strings,",
+    "    # so expiry checks avoid constructing a datetime per reservation.",
+    "    if not expires_ts:",
+    "        return True",
+    "    try:",
+    "        if len(expires_ts) >= 20 and expires_ts[4] == '-':",
+    "            return expires_ts > NOW_ISO",
+    "        return datetime.fromisoformat(expires_ts) > datetime.now(timezone.utc)",
+    "    except Exception:",
+    "        return True",
+    "def _iter_raw_records():",
+    "    # Prefer the concatenated manifest (one open + parse); fall back to the",
+    "    # per-reservation JSON scan for archives written before the manifest existed.",
+    "    try:",
+    "        raw = FILE_RESERVATION_MANIFEST.read_bytes()",
+    "    except Exception:",
+    "        raw = None",
+    "    if raw is not None:",
+    "        for line in raw.splitlines():",
+    "            line = line.strip()",
+    "            if not line:",
+    "                continue",
+    "            try:",
+    "                yield _loads(line)",
+    "            except Exception:",
+    "                continue",
+    "        return",
+    "    # os.scandir avoids a Path object per entry on the fallback scan.",
+    "    try:",
+    "        entries = os.scandir(str(FILE_RESERVATIONS_DIR))",
+    "    except OSError:",
+    "        return",
+    "    with entries:",
+    "        for entry in entries:",
+    "            if not entry.name.endswith('.json') or not entry.is_file():",
+    "                continue",
+    "            try:",
+    "                with open(entry.path, 'rb') as fh:",
+    "                    data = _loads(fh.read())",
+    "            except Exception:",
+    "                continue",
+    "            recs = data if isinstance(data, list) else [data]",
+    "            yield from recs",
+    "def load_file_reservations():",
+    "    # Yield (pattern, holder) for active exclusive reservations held by other agents.",
+    "    for r in _iter_raw_records():",
+    "        if not isinstance(r, dict):",
+    "            continue",
+    "        patt = (r.get('path_pattern') or '').strip()",
+    "        if not patt:",
+    "            continue",
+    "        holder = (r.get('agent') or '').strip()",
+    "        if not r.get('exclusive', True):",
+    "            continue",
+    "        if holder and holder == AGENT_NAME:",
+    "            continue",
+    "        if not _not_expired((r.get('expires_ts') or '').strip()):",
+    "            continue",
+    "        yield patt, holder",
+    "def _compile_spec(active):",
+    "    # Union every pattern into a single compiled PathSpec; check_file()",
+    "    # reports the matching pattern index for conflict attribution.",
+    "    if not (_PS and _GWM):",
+    "        return None",
+    "    try:",
+    "        spec = _PS.from_lines(_GWM, [patt.replace('\\\\','/') for patt, _holder in active])",
+    "    except Exception:",
+    "        return None",
+    "    return spec if hasattr(spec, 'check_file') else None",
+    "def _build_fallback_matcher(active):",
+    "    # Literal patterns become an O(1) dict probe and the common",
+    "    # '*suffix' / 'prefix*' shapes use str.endswith/startswith instead of",
+    "    # a regex; remaining wildcard patterns with a literal prefix are",
+    "    # bucketed so each path only tests plausible candidates; prefix-less",
+    "    # patterns share one unioned regex.",
+    "    literals = {}",
+    "    suffixes = []",
+    "    buckets = {}",
+    "    free_parts = []",
+    "    for idx, (patt, _holder) in enumerate(active):",
+    "        q = patt.replace('\\\\','/').lstrip('/')",
+    "        if not any(c in q for c in '*?['):",
+    "            literals.setdefault(q, idx)",
+    "            continue",
+    "        if q.startswith('*') and not any(c in q[1:] for c in '*?['):",
+    "            suffixes.append((q[1:], idx))",
+    "            continue",
+    "        prefix = re.split(r'[*?\\[]', q, maxsplit=1)[0]",
+    "        if prefix:",
+    "            # A bare 'prefix*' needs no regex: startswith covers it.",
+    "            rx = None if q == prefix + '*' else re.compile(_fn.translate(q))",
+    "            buckets.setdefault(prefix, []).append((rx, idx))",
+    "        else:",
+    "            free_parts.append(f'(?P<g{idx}>{_fn.translate(q)})')",
+    "    free_rx = re.compile('|'.join(free_parts)) if free_parts else None",
+    "    return literals, suffixes, sorted(buckets), buckets, free_rx",
+    "def _fallback_match(norm, literals, suffixes, prefixes, buckets, free_rx):",
+    "    idx = literals.get(norm)",
+    "    if idx is not None:",
+    "        return idx",
+    "    pos = bisect.bisect_right(prefixes, norm)",
+    "    for j in range(pos - 1, -1, -1):",
+    "        prefix = prefixes[j]",
+    "        if prefix[:1] != norm[:1]:",
+    "            # sorted prefixes: nothing earlier can share the first character",
+    "            break",
+    "        if norm.startswith(prefix):",
+    "            for rx, idx in buckets[prefix]:",
+    "                if rx is None or rx.match(norm):",
+    "                    return idx",
+    "    for suffix, idx in suffixes:",
+    "        if norm.endswith(suffix):",
+    "            return idx",
+    "    if free_rx is not None:",
+    "        m = free_rx.match(norm)",
+    "        if m and m.lastgroup:",
+    "            return int(m.lastgroup[1:])",
+    "    return None",
+    "def find_conflicts(candidates, reservations):",
+    "    conflicts = []",
+    "    try:",
+    "        if reservations:",
+    "            spec = _compile_spec(reservations)",
+    "            if spec is not None:",
+    "                for p in candidates:",
+    "                    norm = p.replace('\\\\','/').lstrip('/')",
+    "                    result = spec.check_file(norm)",
+    "                    if result.include:",
+    "                        patt, holder = reservations[result.index]",
+    "                        conflicts.append((patt, p, holder))",
+    "            else:",
+    "                literals, suffixes, prefixes, buckets, free_rx = _build_fallback_matcher(reservations)",
+    "                for p in candidates:",
+    "                    norm = p.replace('\\\\','/').lstrip('/')",
+    "                    idx = _fallback_match(norm, literals, suffixes, prefixes, buckets, free_rx)",
+    "                    if idx is not None:",
+    "                        patt, holder = reservations[idx]",
+    "                        conflicts.append((patt, p, holder))",
+    "    except Exception:",
+    "        conflicts = []",
+    "    return conflicts",
+)
+
+_HOOK_REPORT_LINES: tuple[str, ...] = (
+    "if conflicts:",
+    "    sys.stderr.write(\"Exclusive file_reservation conflicts detected\\n\")",
+    "    for patt, path, holder in conflicts[:10]:",
+    "        sys.stderr.write(f\"- {path} matches {patt} (holder: {holder})\\n\")",
+    "    if ADVISORY:",
+    "        sys.exit(0)",
+    "    sys.exit(1)",
+    "sys.exit(0)",
+)
+
+# Script bodies are fixed apart from the archive paths, so the ~150-line join
+# happens once at import time; rendering is a single Template.substitute call.
+_PRECOMMIT_TEMPLATE = string.Template(
+    "\n".join(
+        [
+            "#!/usr/bin/env python3",
+            "# mcp-agent-mail guard hook (pre-commit)",
+            *_HOOK_HEADER_LINES,
+            "",
+            "HOOK_NAME = \"pre-commit\"",
+            "HOOKRT_PATH = $hookrt_path",
+            "DB_PATH = $db_path",
+            "PROJECT_SLUG = $project_slug",
+            "FILE_RESERVATIONS_DIR = Path($file_reservations_dir)",
+            "FILE_RESERVATION_MANIFEST = Path($file_reservation_manifest)",
+            "STORAGE_ROOT = Path($storage_root)",
+            "",
+            *_HOOK_DELEGATE_LINES,
+            "",
+            *_HOOK_IMPORT_LINES,
+            "",
+            "# Gate variables (presence) and mode",
+            "GATE = (os.environ.get(\"WORKTREES_ENABLED\",\"0\") or os.environ.get(\"GIT_IDENTITY_ENABLED\",\"0\") or \"0\")",
+            "",
+            "# Exit early if gate is not enabled (WORKTREES_ENABLED=0 and GIT_IDENTITY_ENABLED=0)",
+            "if GATE.strip().lower() not in {\"1\",\"true\",\"t\",\"yes\",\"y\"}:",
+            "    sys.exit(0)",
+            "",
+            "# Advisory/blocking mode: default to 'block' unless explicitly set to 'warn'.",
+            "MODE = (os.environ.get(\"AGENT_MAIL_GUARD_MODE\",\"block\") or \"block\").strip().lower()",
+            "ADVISORY = MODE in {\"warn\",\"advisory\",\"adv\"}",
+            "",
+            "# Emergency bypass",
+            "if (os.environ.get(\"AGENT_MAIL_BYPASS\",\"0\") or \"0\").strip().lower() in {\"1\",\"true\",\"t\",\"yes\",\"y\"}:",
+            "    sys.stderr.write(\"[pre-commit] bypass enabled via AGENT_MAIL_BYPASS=1\\n\")",
+            "    sys.exit(0)",
+            "AGENT_NAME = os.environ.get(\"AGENT_NAME\")",
+            "if not AGENT_NAME:",
+            "    sys.stderr.write(\"[pre-commit] AGENT_NAME environment variable is required.\\n\")",
+            "    sys.exit(1)",
+            "",
+            *_HOOK_RESERVATION_LINES,
+            "",
+            "# No foreign active reservations means no possible conflict: exit",
+            "# before spawning any git subprocess.",
+            "reservations = list(load_file_reservations())",
+            "if not reservations:",
+            "    sys.exit(0)",
+            "",
+            "# Collect staged paths from one name-status scan, expanding renames (old+new)",
+            "paths = []",
+            "try:",
+            "    cs = subprocess.run([\"git\",\"diff\",\"--cached\",\"--name-status\",\"-M\",\"-z\",\"--diff-filter=ACMRDTU\"],",
+            "                        check=True,capture_output=True)",
+            "    sdata = cs.stdout.decode(\"utf-8\",\"ignore\")",
+            "    parts = [x for x in sdata.split(\"\\x00\") if x]",
+            "    i = 0",
+            "    while i < len(parts):",
+            "        status = parts[i]",
+            "        i += 1",
+            "        if status.startswith(\"R\") and i + 1 < len(parts):",
+            "            oldp = parts[i]; newp = parts[i+1]; i += 2",
+            "            if oldp: paths.append(oldp)",
+            "            if newp: paths.append(newp)",
+            "        else:",
+            "            # Status followed by one path",
+            "            if i < len(parts):",
+            "                pth = parts[i]; i += 1",
+            "                if pth: paths.append(pth)",
+            "except Exception:",
+            "    pass",
+            "",
+            "if not paths:",
+            "    sys.exit(0)",
+            "",
+            "conflicts = find_conflicts(paths, reservations)",
+            *_HOOK_REPORT_LINES,
+        ]
+    )
+    + "\n"
+)
+
+_PREPUSH_TEMPLATE = string.Template(
+    "\n".join(
+        [
+            "#!/usr/bin/env python3",
+            "# mcp-agent-mail guard hook (pre-push)",
+            *_HOOK_HEADER_LINES,
+            "",
+            "HOOK_NAME = \"pre-push\"",
+            "HOOKRT_PATH = $hookrt_path",
+            "DB_PATH = $db_path",
+            "PROJECT_SLUG = $project_slug",
+            "FILE_RESERVATIONS_DIR = Path($file_reservations_dir)",
+            "FILE_RESERVATION_MANIFEST = Path($file_reservation_manifest)",
+            "",
+            *_HOOK_DELEGATE_LINES,
+            "",
+            *_HOOK_IMPORT_LINES,
+            "",
+            "# Gate variables (presence) and mode",
+            "GATE = (os.environ.get(\"WORKTREES_ENABLED\",\"0\") or os.environ.get(\"GIT_IDENTITY_ENABLED\",\"0\") or \"0\")",
+            "",
+            "# Exit early if gate is not enabled (WORKTREES_ENABLED=0 and GIT_IDENTITY_ENABLED=0)",
+            "if GATE.strip().lower() not in {\"1\",\"true\",\"t\",\"yes\",\"y\"}:",
+            "    sys.exit(0)",
+            "",
+            "MODE = (os.environ.get(\"AGENT_MAIL_GUARD_MODE\",\"block\") or \"block\").strip().lower()",
+            "ADVISORY = MODE in {\"warn\",\"advisory\",\"adv\"}",
+            "if (os.environ.get(\"AGENT_MAIL_BYPASS\",\"0\") or \"0\").strip().lower() in {\"1\",\"true\",\"t\",\"yes\",\"y\"}:",
+            "    sys.stderr.write(\"[pre-push] bypass enabled via AGENT_MAIL_BYPASS=1\\n\")",
+            "    sys.exit(0)",
+            "AGENT_NAME = os.environ.get(\"AGENT_NAME\")",
+            "if not AGENT_NAME:",
+            "    sys.stderr.write(\"[pre-push] AGENT_NAME environment variable is required.\\n\")",
+            "    sys.exit(1)",
+            "if not FILE_RESERVATIONS_DIR.exists():",
+            "    sys.exit(0)",
+            "",
+            *_HOOK_RESERVATION_LINES,
+            "",
+            "# No foreign active reservations means no possible conflict: exit",
+            "# before spawning any git subprocess.",
+            "reservations = list(load_file_reservations())",
+            "if not reservations:",
+            "    sys.exit(0)",
+            "",
+            "# Read tuples from STDIN: <local ref> <local sha> <remote ref> <remote sha>",
+            "tuples = []",
+            "for line in sys.stdin.read().splitlines():",
+            "    parts = line.strip().split()",
+            "    if len(parts) >= 4:",
+            "        tuples.append((parts[0], parts[1], parts[2], parts[3]))",
+            "",
+            "changed = []",
+            "commits = []",
+            "for local_ref, local_sha, remote_ref, remote_sha in tuples:",
+            "    if not local_sha:",
+            "        continue",
+            "    # Enumerate commits to be pushed using remote name from args (argv[1]) when available",
+            "    remote = (sys.argv[1] if len(sys.argv) > 1 else \"origin\")",
+            "    try:",
+            "        cp = subprocess.run([\"git\",\"rev-list\",\"--topo-order\",local_sha,\"--not\",f\"--remotes={remote}\"],",
+            "                            check=True,capture_output=True,text=True)",
+            "        for sha in cp.stdout.splitlines():",
+            "            if sha:",
+            "                commits.append(sha.strip())",
+            "    except Exception:",
+            "        # Fallback: gather changed paths directly when range enumeration fails",
+            "        rng = local_sha if (not remote_sha or set(remote_sha) == {\"0\"}) else f\"{remote_sha}..{local_sha}\"",
+            "        try:",
+            "            cp = subprocess.run([\"git\",\"diff\",\"--name-only\",rng],check=True,capture_output=True,text=True)",
+            "            for p in cp.stdout.splitlines():",
+            "                if p:",
+            "                    changed.append(p.strip())",
+            "        except Exception:",
+            "            pass",
+            "",
+            "# changed already initialized above; add per-commit changed paths.",
+            "# --stdin lets one diff-tree process cover the whole push range.",
+            "if commits:",
+            "    try:",
+            "        cp = subprocess.run([\"git\",\"diff-tree\",\"--stdin\",\"-r\",\"--no-commit-id\",\"--name-only\",\"--no-ext-diff\",\"--diff-filter=ACMRDTU\",\"-z\"],",
+            "                            input=\"\\n\".join(commits).encode(),check=True,capture_output=True)",
+            "        data = cp.stdout.decode(\"utf-8\",\"ignore\")",
+            "        changed.extend(p for p in data.split(\"\\x00\") if p)",
+            "    except Exception:",
+            "        pass",
+            "",
+            "# Local conflict detection against FILE_RESERVATIONS_DIR using changed paths",
+            "if not changed:",
+            "    sys.exit(0)",
+            "conflicts = find_conflicts(changed, reservations)",
+            *_HOOK_REPORT_LINES,
+        ]
+    )
+    + "\n"
+)
+
+
+def _sqlite_db_path(settings: Settings) -> Path | None:
+    """Extract the filesystem path from a file-backed SQLite database URL.
+
+    Returns None for in-memory or non-SQLite URLs; the hooks then rely solely
+    on the JSON reservation artifacts.
+    """
+
+    url = settings.database.url
+    marker = ":///"
+    if not url.startswith("sqlite") or marker not in url:
+        return None
+    raw = url.split(marker, 1)[1]
+    if not raw or raw.startswith(":memory:") or raw.startswith("file:"):
+        return None
+    return Path(raw).expanduser().resolve()
+
+
+def _render_db_literals(archive: ProjectArchive) -> dict[str, str]:
+    # Renderers are duck-typed over the archive (tests pass bare stand-ins),
+    # so a missing settings/slug simply disables the database lookup.
+    settings = getattr(archive, "settings", None)
+    db_path = _sqlite_db_path(settings) if settings is not None else None
+    slug = getattr(archive, "slug", "")
+    return {
+        "db_path": json.dumps(str(db_path)) if db_path is not None else "None",
+        "project_slug": json.dumps(slug) if slug else "None",
+    }
+
+
 def render_precommit_script(archive: ProjectArchive) -> str:
     """Return the pre-commit script content for the given archive.
 
-    Construct with explicit lines at column 0 to avoid indentation errors.
+    The template is assembled once at import time; only the archive paths vary,
+    substituted as JSON string literals to stay safe under quotes/backslashes.
     """
 
-    file_reservations_dir = str((archive.root / "file_reservations").resolve())
-    storage_root = str(archive.root.resolve())
-    lines = [
-        "#!/usr/bin/env python3",
-        "# mcp-agent-mail guard hook (pre-commit)",
-        "import json",
-        "import os",
-        "import sys",
-        "import subprocess",
-        "from pathlib import Path",
-        "import fnmatch as _fn",
-        "from datetime import datetime, timezone",
-        "",
-        "# Optional Git pathspec support (preferred when available)",
-        "try:",
-        "    from pathspec import PathSpec as _PS  # type: ignore[import-not-found]",
-        "    from pathspec.patterns.gitwildmatch import GitWildMatchPattern as _GWM  # type: ignore[import-not-found]",
-        "except Exception:",
-        "    _PS = None  # type: ignore[assignment]",
-        "    _GWM = None  # type: ignore[assignment]",
-        "",
-        f"FILE_RESERVATIONS_DIR = Path(\"{file_reservations_dir}\")",
-        f"STORAGE_ROOT = Path(\"{storage_root}\")",
-        "",
-        "# Gate variables (presence) and mode",
-        "GATE = (os.environ.get(\"WORKTREES_ENABLED\",\"0\") or os.environ.get(\"GIT_IDENTITY_ENABLED\",\"0\") or \"0\")",
-        "",
-        "# Exit early if gate is not enabled (WORKTREES_ENABLED=0 and GIT_IDENTITY_ENABLED=0)",
-        "if GATE.strip().lower() not in {\"1\",\"true\",\"t\",\"yes\",\"y\"}:",
-        "    sys.exit(0)",
-        "",
-        "# Advisory/blocking mode: default to 'block' unless explicitly set to 'warn'.",
-        "MODE = (os.environ.get(\"AGENT_MAIL_GUARD_MODE\",\"block\") or \"block\").strip().lower()",
-        "ADVISORY = MODE in {\"warn\",\"advisory\",\"adv\"}",
-        "",
-        "# Emergency bypass",
-        "if (os.environ.get(\"AGENT_MAIL_BYPASS\",\"0\") or \"0\").strip().lower() in {\"1\",\"true\",\"t\",\"yes\",\"y\"}:",
-        "    sys.stderr.write(\"[pre-commit] bypass enabled via AGENT_MAIL_BYPASS=1\\n\")",
-        "    sys.exit(0)",
-        "AGENT_NAME = os.environ.get(\"AGENT_NAME\")",
-        "if not AGENT_NAME:",
-        "    sys.stderr.write(\"[pre-commit] AGENT_NAME environment variable is required.\\n\")",
-        "    sys.exit(1)",
-        "",
-        "# Collect staged paths (name-only) and expand renames/moves (old+new)",
-        "paths = []",
-        "try:",
-        "    co = subprocess.run([\"git\",\"diff\",\"--cached\",\"--name-only\",\"-z\",\"--diff-filter=ACMRDTU\"],",
-        "                        check=True,capture_output=True)",
-        "    data = co.stdout.decode(\"utf-8\",\"ignore\")",
-        "    for p in data.split(\"\\x00\"):",
-        "        if p:",
-        "            paths.append(p)",
-        "    # Rename detection: capture both old and new names",
-        "    cs = subprocess.run([\"git\",\"diff\",\"--cached\",\"--name-status\",\"-M\",\"-z\"],",
-        "                        check=True,capture_output=True)",
-        "    sdata = cs.stdout.decode(\"utf-8\",\"ignore\")",
-        "    parts = [x for x in sdata.split(\"\\x00\") if x]",
-        "    i = 0",
-        "    while i < len(parts):",
-        "        status = parts[i]",
-        "        i += 1",
-        "        if status.startswith(\"R\") and i + 1 < len(parts):",
-        "            oldp = parts[i]; newp = parts[i+1]; i += 2",
-        "            if oldp: paths.append(oldp)",
-        "            if newp: paths.append(newp)",
-        "        else:",
-        "            # Status followed by one path",
-        "            if i < len(parts):",
-        "                pth = parts[i]; i += 1",
-        "                if pth: paths.append(pth)",
-        "except Exception:",
-        "    pass",
-        "",
-        "if not paths:",
-        "    sys.exit(0)",
-        "",
-        "# Local conflict detection against FILE_RESERVATIONS_DIR",
-        "def _now_iso_utc():",
-        "    return datetime.now(timezone.utc).isoformat()",
-        "def _not_expired(expires_ts):",
-        "    if not expires_ts:",
-        "        return True",
-        "    try:",
-        "        return expires_ts > _now_iso_utc()",
-        "    except Exception:",
-        "        return True",
-        "def _compile_one(patt):",
-        "    q = patt.replace(\"\\\\\",\"/\")",
-        "    if _PS and _GWM:",
-        "        try:",
-        "            return _PS.from_lines(_GWM, [q])",
-        "        except Exception:",
-        "            return None",
-        "    return None",
-        "conflicts = []",
-        "try:",
-        "    for f in FILE_RESERVATIONS_DIR.iterdir():",
-        "        if not f.name.endswith('.json'):",
-        "            continue",
-        "        try:",
-        "            data = json.loads(f.read_text(encoding='utf-8'))",
-        "        except Exception:",
-        "            continue",
-        "        recs = data if isinstance(data, list) else [data]",
-        "        for r in recs:",
-        "            if not isinstance(r, dict):",
-        "                continue",
-        "            patt = (r.get('path_pattern') or '').strip()",
-        "            if not patt:",
-        "                continue",
-        "            holder = (r.get('agent') or '').strip()",
-        "            exclusive = r.get('exclusive', True)",
-        "            expires = (r.get('expires_ts') or '').strip()",
-        "            if not exclusive:",
-        "                continue",
-        "            if holder and holder == AGENT_NAME:",
-        "                continue",
-        "            spec = _compile_one(patt)",
-        "            for p in paths:",
-        "                norm = p.replace('\\\\','/').lstrip('/')",
-        "                matched = spec.match_file(norm) if spec is not None else _fn.fnmatch(norm, patt)",
-        "                if matched and _not_expired(expires):",
-        "                    conflicts.append((patt, p, holder))",
-        "except Exception:",
-        "    conflicts = []",
-        "if conflicts:",
-        "    sys.stderr.write(\"Exclusive file_reservation conflicts detected\\n\")",
-        "    for patt, path, holder in conflicts[:10]:",
-        "        sys.stderr.write(f\"- {path} matches {patt} (holder: {holder})\\n\")",
-        "    if ADVISORY:",
-        "        sys.exit(0)",
-        "    sys.exit(1)",
-        "sys.exit(0)",
-    ]
-    return "\n".join(lines) + "\n"
+    return _PRECOMMIT_TEMPLATE.substitute(
+        hookrt_path=json.dumps(str(Path(__file__).with_name("_hookrt.py"))),
+        file_reservations_dir=json.dumps(str((archive.root / "file_reservations").resolve())),
+        file_reservation_manifest=json.dumps(str((archive.root / "file_reservations.ndjson").resolve())),
+        storage_root=json.dumps(str(archive.root.resolve())),
+        **_render_db_literals(archive),
+    )
 
 
 def render_prepush_script(archive: ProjectArchive) -> str:
@@ -248,225 +597,58 @@ def render_prepush_script(archive: ProjectArchive) -> str:
 
     Python script to avoid external shell assumptions; NUL-safe and respects gate/advisory mode.
     """
-    file_reservations_dir = str((archive.root / "file_reservations").resolve())
-    lines = [
-        "#!/usr/bin/env python3",
-        "# mcp-agent-mail guard hook (pre-push)",
-        "import json",
-        "import os",
-        "import sys",
-        "import subprocess",
-        "from pathlib import Path",
-        "import fnmatch as _fn",
-        "from datetime import datetime, timezone",
-        "",
-        "# Optional Git pathspec support (preferred when available)",
-        "try:",
-        "    from pathspec import PathSpec as _PS  # type: ignore[import-not-found]",
-        "    from pathspec.patterns.gitwildmatch import GitWildMatchPattern as _GWM  # type: ignore[import-not-found]",
-        "except Exception:",
-        "    _PS = None  # type: ignore[assignment]",
-        "    _GWM = None  # type: ignore[assignment]",
-        "",
-        f"FILE_RESERVATIONS_DIR = Path(\"{file_reservations_dir}\")",
-        "",
-        "# Gate variables (presence) and mode",
-        "GATE = (os.environ.get(\"WORKTREES_ENABLED\",\"0\") or os.environ.get(\"GIT_IDENTITY_ENABLED\",\"0\") or \"0\")",
-        "",
-        "# Exit early if gate is not enabled (WORKTREES_ENABLED=0 and GIT_IDENTITY_ENABLED=0)",
-        "if GATE.strip().lower() not in {\"1\",\"true\",\"t\",\"yes\",\"y\"}:",
-        "    sys.exit(0)",
-        "",
-        "MODE = (os.environ.get(\"AGENT_MAIL_GUARD_MODE\",\"block\") or \"block\").strip().lower()",
-        "ADVISORY = MODE in {\"warn\",\"advisory\",\"adv\"}",
-        "if (os.environ.get(\"AGENT_MAIL_BYPASS\",\"0\") or \"0\").strip().lower() in {\"1\",\"true\",\"t\",\"yes\",\"y\"}:",
-        "    sys.stderr.write(\"[pre-push] bypass enabled via AGENT_MAIL_BYPASS=1\\n\")",
-        "    sys.exit(0)",
-        "AGENT_NAME = os.environ.get(\"AGENT_NAME\")",
-        "if not AGENT_NAME:",
-        "    sys.stderr.write(\"[pre-push] AGENT_NAME environment variable is required.\\n\")",
-        "    sys.exit(1)",
-        "if not FILE_RESERVATIONS_DIR.exists():",
-        "    sys.exit(0)",
-        "",
-        "# Read tuples from STDIN: <local ref> <local sha> <remote ref> <remote sha>",
-        "tuples = []",
-        "for line in sys.stdin.read().splitlines():",
-        "    parts = line.strip().split()",
-        "    if len(parts) >= 4:",
-        "        tuples.append((parts[0], parts[1], parts[2], parts[3]))",
-        "",
-        "changed = []",
-        "commits = []",
-        "for local_ref, local_sha, remote_ref, remote_sha in tuples:",
-        "    if not local_sha:",
-        "        continue",
-        "    # Enumerate commits to be pushed using remote name from args (argv[1]) when available",
-        "    remote = (sys.argv[1] if len(sys.argv) > 1 else \"origin\")",
-        "    try:",
-        "        cp = subprocess.run([\"git\",\"rev-list\",\"--topo-order\",local_sha,\"--not\",f\"--remotes={remote}\"],",
-        "                            check=True,capture_output=True,text=True)",
-        "        for sha in cp.stdout.splitlines():",
-        "            if sha:",
-        "                commits.append(sha.strip())",
-        "    except Exception:",
-        "        # Fallback: gather changed paths directly when range enumeration fails",
-        "        rng = local_sha if (not remote_sha or set(remote_sha) == {\"0\"}) else f\"{remote_sha}..{local_sha}\"",
-        "        try:",
-        "            cp = subprocess.run([\"git\",\"diff\",\"--name-only\",rng],check=True,capture_output=True,text=True)",
-        "            for p in cp.stdout.splitlines():",
-        "                if p:",
-        "                    changed.append(p.strip())",
-        "        except Exception:",
-        "            pass",
-        "",
-        "# changed already initialized above; add per-commit changed paths",
-        "for c in commits:",
-        "    try:",
-        "        cp = subprocess.run([\"git\",\"diff-tree\",\"-r\",\"--no-commit-id\",\"--name-only\",\"--no-ext-diff\",\"--diff-filter=ACMRDTU\",\"-z\",c],",
-        "                            check=True,capture_output=True)",
-        "        data = cp.stdout.decode(\"utf-8\",\"ignore\")",
-        "        paths = [p for p in data.split(\"\\x00\") if p]",
-        "        changed.extend(paths)",
-        "    except Exception:",
-        "        continue",
-        "",
-        "# Local conflict detection against FILE_RESERVATIONS_DIR using changed paths",
-        "if not changed:",
-        "    sys.exit(0)",
-        "def _now_iso_utc():",
-        "    return datetime.now(timezone.utc).isoformat()",
-        "def _not_expired(expires_ts):",
-        "    if not expires_ts:",
-        "        return True",
-        "    try:",
-        "        return expires_ts > _now_iso_utc()",
-        "    except Exception:",
-        "        return True",
-        "def _compile_one(patt):",
-        "    q = patt.replace(\"\\\\\",\"/\")",
-        "    if _PS and _GWM:",
-        "        try:",
-        "            return _PS.from_lines(_GWM, [q])",
-        "        except Exception:",
-        "            return None",
-        "    return None",
-        "conflicts = []",
-        "try:",
-        "    for f in FILE_RESERVATIONS_DIR.iterdir():",
-        "        if not f.name.endswith('.json'):",
-        "            continue",
-        "        try:",
-        "            data = json.loads(f.read_text(encoding='utf-8'))",
-        "        except Exception:",
-        "            continue",
-        "        recs = data if isinstance(data, list) else [data]",
-        "        for r in recs:",
-        "            if not isinstance(r, dict):",
-        "                continue",
-        "            patt = (r.get('path_pattern') or '').strip()",
-        "            if not patt:",
-        "                continue",
-        "            holder = (r.get('agent') or '').strip()",
-        "            exclusive = r.get('exclusive', True)",
-        "            expires = (r.get('expires_ts') or '').strip()",
-        "            if not exclusive:",
-        "                continue",
-        "            if holder and holder == AGENT_NAME:",
-        "                continue",
-        "            spec = _compile_one(patt)",
-        "            for p in changed:",
-        "                norm = p.replace('\\\\','/').lstrip('/')",
-        "                matched = spec.match_file(norm) if spec is not None else _fn.fnmatch(norm, patt)",
-        "                if matched and _not_expired(expires):",
-        "                    conflicts.append((patt, p, holder))",
-        "except Exception:",
-        "    conflicts = []",
-        "if conflicts:",
-        "    sys.stderr.write(\"Exclusive file_reservation conflicts detected\\n\")",
-        "    for patt, path, holder in conflicts[:10]:",
-        "        sys.stderr.write(f\"- {path} matches {patt} (holder: {holder})\\n\")",
-        "    if ADVISORY:",
-        "        sys.exit(0)",
-        "    sys.exit(1)",
-        "sys.exit(0)",
-    ]
-    return "\n".join(lines) + "\n"
 
+    return _PREPUSH_TEMPLATE.substitute(
+        hookrt_path=json.dumps(str(Path(__file__).with_name("_hookrt.py"))),
+        file_reservations_dir=json.dumps(str((archive.root / "file_reservations").resolve())),
+        file_reservation_manifest=json.dumps(str((archive.root / "file_reservations.ndjson").resolve())),
+        **_render_db_literals(archive),
+    )
 
-async def install_guard(settings: Settings, project_slug: str, repo_path: Path) -> Path:
-    """Install the pre-commit chain-runner and Agent Mail guard plugin."""
 
-    archive = await ensure_archive(settings, project_slug)
+_PLUGIN_RENDERERS: dict[str, Callable[[ProjectArchive], str]] = {
+    "pre-commit": render_precommit_script,
+    "pre-push": render_prepush_script,
+}
 
-    def _git(cwd: Path, *args: str) -> str | None:
-        try:
-            cp = subprocess.run(["git", "-C", str(cwd), *args], check=True, capture_output=True, text=True)
-            return cp.stdout.strip()
-        except Exception:
-            return None
-
-    def _resolve_hooks_dir(repo: Path) -> Path:
-        # Prefer core.hooksPath if configured
-        hooks_path = _git(repo, "config", "--get", "core.hooksPath")
-        if hooks_path:
-            if hooks_path.startswith("/") or (((len(hooks_path) > 1) and ((hooks_path[1:3] == ":\\") or (hooks_path[1:3] == ":/")))):
-                resolved = Path(hooks_path)
-            else:
-                # Resolve relative to repo root
-                root = _git(repo, "rev-parse", "--show-toplevel") or str(repo)
-                resolved = Path(root) / hooks_path
-            return resolved
-        # Fall back to git-dir/hooks
-        git_dir = _git(repo, "rev-parse", "--git-dir")
-        if git_dir:
-            g = Path(git_dir)
-            if not g.is_absolute():
-                g = repo / g
-            return g / "hooks"
-        # Last resort: traditional path
-        return repo / ".git" / "hooks"
-
-    hooks_dir = _resolve_hooks_dir(repo_path)
-    if not hooks_dir.exists():
-        await asyncio.to_thread(hooks_dir.mkdir, parents=True, exist_ok=True)
-
-    # Ensure hooks.d/pre-commit exists
-    run_dir = hooks_dir / "hooks.d" / "pre-commit"
+
+async def _install_hook_files(hooks_dir: Path, hook_name: str, plugin_script: str) -> Path:
+    """Write the chain-runner, Windows shims, and guard plugin for one hook."""
+
+    run_dir = hooks_dir / "hooks.d" / hook_name
     await asyncio.to_thread(run_dir.mkdir, parents=True, exist_ok=True)
 
-    chain_path = hooks_dir / "pre-commit"
+    chain_path = hooks_dir / hook_name
     # Preserve existing non-chain hook as .orig
     if chain_path.exists():
         try:
             content = (await asyncio.to_thread(chain_path.read_text, "utf-8")).strip()
         except Exception:
             content = ""
-        if "mcp-agent-mail chain-runner (pre-commit)" not in content:
-            orig = hooks_dir / "pre-commit.orig"
+        if f"mcp-agent-mail chain-runner ({hook_name})" not in content:
+            orig = hooks_dir / f"{hook_name}.orig"
             if not orig.exists():
                 await asyncio.to_thread(chain_path.replace, orig)
     # Write/overwrite chain-runner
-    chain_script = _render_chain_runner_script("pre-commit")
-    await asyncio.to_thread(chain_path.write_text, chain_script, "utf-8")
-    await asyncio.to_thread(os.chmod, chain_path, 0o755)
+    chain_script = _render_chain_runner_script(hook_name)
+    await asyncio.to_thread(_write_executable, chain_path, chain_script)
 
     # Windows shims (.cmd / .ps1) to invoke the Python chain-runner
-    cmd_path = hooks_dir / "pre-commit.cmd"
+    cmd_path = hooks_dir / f"{hook_name}.cmd"
     if not cmd_path.exists():
         cmd_body = (
             "@echo off\r\n"
             "setlocal\r\n"
             "set \"DIR=%~dp0\"\r\n"
-            "python \"%DIR%pre-commit\" %*\r\n"
+            f"python \"%DIR%{hook_name}\" %*\r\n"
             "exit /b %ERRORLEVEL%\r\n"
         )
         await asyncio.to_thread(cmd_path.write_text, cmd_body, "utf-8")
-    ps1_path = hooks_dir / "pre-commit.ps1"
+    ps1_path = hooks_dir / f"{hook_name}.ps1"
     if not ps1_path.exists():
         ps1_body = (
             "$ErrorActionPreference = 'Stop'\n"
-            "$hook = Join-Path $PSScriptRoot 'pre-commit'\n"
+            f"$hook = Join-Path $PSScriptRoot '{hook_name}'\n"
             "python $hook @args\n"
             "exit $LASTEXITCODE\n"
         )
@@ -474,86 +656,52 @@ async def install_guard(settings: Settings, project_slug: str, repo_path: Path)
 
     # Write our guard plugin
     plugin_path = run_dir / "50-agent-mail.py"
-    plugin_script = render_precommit_script(archive)
-    await asyncio.to_thread(plugin_path.write_text, plugin_script, "utf-8")
-    await asyncio.to_thread(os.chmod, plugin_path, 0o755)
+    await asyncio.to_thread(_write_executable, plugin_path, plugin_script)
     return chain_path
 
 
-async def install_prepush_guard(settings: Settings, project_slug: str, repo_path: Path) -> Path:
-    """Install the pre-push chain-runner and Agent Mail guard plugin."""
-    archive = await ensure_archive(settings, project_slug)
+async def install_guards(
+    settings: Settings,
+    project_slug: str,
+    repo_path: Path,
+    *,
+    hooks: tuple[str, ...] = ("pre-commit", "pre-push"),
+    archive: ProjectArchive | None = None,
+) -> dict[str, Path]:
+    """Install guard hooks for a repository, resolving shared state once.
+
+    The archive and hooks directory are resolved a single time no matter how
+    many hooks are requested; per-hook work is just rendering and writing.
+    Callers that already hold the project's archive (e.g. after a batched
+    ensure_archives) can pass it to skip the lookup entirely. Returns a
+    mapping of hook name to installed chain-runner path.
+    """
 
-    def _git(cwd: Path, *args: str) -> str | None:
-        try:
-            cp = subprocess.run(["git", "-C", str(cwd), *args], check=True, capture_output=True, text=True)
-            return cp.stdout.strip()
-        except Exception:
-            return None
-
-    def _resolve_hooks_dir(repo: Path) -> Path:
-        hooks_path = _git(repo, "config", "--get", "core.hooksPath")
-        if hooks_path:
-            if hooks_path.startswith("/") or (((len(hooks_path) > 1) and ((hooks_path[1:3] == ":\\") or (hooks_path[1:3] == ":/")))):
-                resolved = Path(hooks_path)
-            else:
-                root = _git(repo, "rev-parse", "--show-toplevel") or str(repo)
-                resolved = Path(root) / hooks_path
-            return resolved
-        git_dir = _git(repo, "rev-parse", "--git-dir")
-        if git_dir:
-            g = Path(git_dir)
-            if not g.is_absolute():
-                g = repo / g
-            return g / "hooks"
-        return repo / ".git" / "hooks"
-
-    hooks_dir = _resolve_hooks_dir(repo_path)
+    if archive is None:
+        archive = await ensure_archive(settings, project_slug)
+
+    hooks_dir = _resolve_hooks_dir_cached(str(repo_path))
     await asyncio.to_thread(hooks_dir.mkdir, parents=True, exist_ok=True)
-    # Ensure hooks.d/pre-push exists
-    run_dir = hooks_dir / "hooks.d" / "pre-push"
-    await asyncio.to_thread(run_dir.mkdir, parents=True, exist_ok=True)
 
-    chain_path = hooks_dir / "pre-push"
-    if chain_path.exists():
-        try:
-            content = (await asyncio.to_thread(chain_path.read_text, "utf-8")).strip()
-        except Exception:
-            content = ""
-        if "mcp-agent-mail chain-runner (pre-push)" not in content:
-            orig = hooks_dir / "pre-push.orig"
-            if not orig.exists():
-                await asyncio.to_thread(chain_path.replace, orig)
-    chain_script = _render_chain_runner_script("pre-push")
-    await asyncio.to_thread(chain_path.write_text, chain_script, "utf-8")
-    await asyncio.to_thread(os.chmod, chain_path, 0o755)
+    installed: dict[str, Path] = {}
+    for hook_name in hooks:
+        plugin_script = _PLUGIN_RENDERERS[hook_name](archive)
+        installed[hook_name] = await _install_hook_files(hooks_dir, hook_name, plugin_script)
+    return installed
 
-    # Windows shims (.cmd / .ps1) to invoke the Python chain-runner
-    cmd_path = hooks_dir / "pre-push.cmd"
-    if not cmd_path.exists():
-        cmd_body = (
-            "@echo off\r\n"
-            "setlocal\r\n"
-            "set \"DIR=%~dp0\"\r\n"
-            "python \"%DIR%pre-push\" %*\r\n"
-            "exit /b %ERRORLEVEL%\r\n"
-        )
-        await asyncio.to_thread(cmd_path.write_text, cmd_body, "utf-8")
-    ps1_path = hooks_dir / "pre-push.ps1"
-    if not ps1_path.exists():
-        ps1_body = (
-            "$ErrorActionPreference = 'Stop'\n"
-            "$hook = Join-Path $PSScriptRoot 'pre-push'\n"
-            "python $hook @args\n"
-            "exit $LASTEXITCODE\n"
-        )
-        await asyncio.to_thread(ps1_path.write_text, ps1_body, "utf-8")
 
-    plugin_path = run_dir / "50-agent-mail.py"
-    plugin_script = render_prepush_script(archive)
-    await asyncio.to_thread(plugin_path.write_text, plugin_script, "utf-8")
-    await asyncio.to_thread(os.chmod, plugin_path, 0o755)
-    return chain_path
+async def install_guard(settings: Settings, project_slug: str, repo_path: Path) -> Path:
+    """Install the pre-commit chain-runner and Agent Mail guard plugin."""
+
+    installed = await install_guards(settings, project_slug, repo_path, hooks=("pre-commit",))
+    return installed["pre-commit"]
+
+
+async def install_prepush_guard(settings: Settings, project_slug: str, repo_path: Path) -> Path:
+    """Install the pre-push chain-runner and Agent Mail guard plugin."""
+
+    installed = await install_guards(settings, project_slug, repo_path, hooks=("pre-push",))
+    return installed["pre-push"]
 
 
 async def uninstall_guard(repo_path: Path) -> bool:
@@ -564,29 +712,7 @@ async def uninstall_guard(repo_path: Path) -> bool:
       Agent Mail hooks (sentinel present) and not chain-runners.
     """
 
-    def _git(cwd: Path, *args: str) -> str | None:
-        try:
-            cp = subprocess.run(["git", "-C", str(cwd), *args], check=True, capture_output=True, text=True)
-            return cp.stdout.strip()
-        except Exception:
-            return None
-
-    def _resolve_hooks_dir(repo: Path) -> Path:
-        hooks_path = _git(repo, "config", "--get", "core.hooksPath")
-        if hooks_path:
-            if hooks_path.startswith("/") or (((len(hooks_path) > 1) and ((hooks_path[1:3] == ":\\") or (hooks_path[1:3] == ":/")))):
-                return Path(hooks_path)
-            root = _git(repo, "rev-parse", "--show-toplevel") or str(repo)
-            return Path(root) / hooks_path
-        git_dir = _git(repo, "rev-parse", "--git-dir")
-        if git_dir:
-            g = Path(git_dir)
-            if not g.is_absolute():
-                g = repo / g
-            return g / "hooks"
-        return repo / ".git" / "hooks"
-
-    hooks_dir = _resolve_hooks_dir(repo_path)
+    hooks_dir = _resolve_hooks_dir_cached(str(repo_path))
     removed = False
     # Remove our hooks.d plugins if present
     for sub in ("pre-commit", "pre-push"):
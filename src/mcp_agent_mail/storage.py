@@ -11,6 +11,7 @@ import os
 import re
 import sys
 import time
+import weakref
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
@@ -167,6 +168,10 @@ class _LRURepoCache:
 _REPO_CACHE: _LRURepoCache = _LRURepoCache(maxsize=8)
 _REPO_CACHE_LOCK: asyncio.Lock | None = None
 
+# Every Repo this module opens, tracked weakly so test teardown can close
+# stragglers by iterating this set instead of scanning the whole heap.
+_OPEN_REPOS: weakref.WeakSet[Repo] = weakref.WeakSet()
+
 
 def _get_repo_cache_lock() -> asyncio.Lock:
     """Get or create the repo cache lock (must be called from async context)."""
@@ -532,6 +537,32 @@ async def ensure_archive(settings: Settings, slug: str) -> ProjectArchive:
     )
 
 
+async def ensure_archives(settings: Settings, slugs: Sequence[str]) -> dict[str, ProjectArchive]:
+    """Resolve archives for several projects with one archive-root setup.
+
+    ensure_archive re-resolves the storage root and repo on every call; when a
+    caller needs archives for many slugs at once this does that work a single
+    time and fans out the cheap per-project mkdir.
+    """
+
+    repo_root, repo = await ensure_archive_root(settings)
+    archives: dict[str, ProjectArchive] = {}
+    for slug in slugs:
+        if slug in archives:
+            continue
+        project_root = repo_root / "projects" / slug
+        await _to_thread(project_root.mkdir, parents=True, exist_ok=True)
+        archives[slug] = ProjectArchive(
+            settings=settings,
+            slug=slug,
+            root=project_root,
+            repo=repo,
+            lock_path=project_root / ".archive.lock",
+            repo_root=repo_root,
+        )
+    return archives
+
+
 async def _ensure_repo(root: Path, settings: Settings) -> Repo:
     """Get or create a Repo for the given root, with caching to prevent file handle leaks."""
     cache_key = str(root.resolve())
@@ -551,11 +582,15 @@ async def _ensure_repo(root: Path, settings: Settings) -> Repo:
         git_dir = root / ".git"
         if git_dir.exists():
             repo = Repo(str(root))
+            _OPEN_REPOS.add(repo)
             _REPO_CACHE.put(cache_key, repo)
             return repo
 
         repo_result = await _to_thread(Repo.init, str(root))
+        if isinstance(repo_result, Repo):
+            _OPEN_REPOS.add(repo_result)
         repo = Repo(repo_result.working_dir) if hasattr(repo_result, 'working_dir') else repo_result
+        _OPEN_REPOS.add(repo)
         # Ensure deterministic, non-interactive commits (disable GPG signing)
         try:
             def _configure_repo() -> None:
@@ -579,6 +614,41 @@ async def write_agent_profile(archive: ProjectArchive, agent: dict[str, object])
     await _commit(archive.repo, archive.settings, f"agent: profile {agent['name']}", [rel])
 
 
+def file_reservation_manifest_path(archive: ProjectArchive) -> Path:
+    """Return the path of the concatenated file-reservation manifest."""
+
+    return archive.root / "file_reservations.ndjson"
+
+
+async def rebuild_file_reservation_manifest(archive: ProjectArchive) -> Path:
+    """Atomically rewrite the NDJSON manifest mirroring per-reservation artifacts.
+
+    The manifest holds one JSON object per line so the rendered guard hooks can
+    read a single file instead of opening and parsing every `*.json` artifact.
+    """
+
+    reservations_dir = archive.root / "file_reservations"
+    manifest_path = file_reservation_manifest_path(archive)
+
+    def _rebuild() -> None:
+        lines: list[str] = []
+        if reservations_dir.exists():
+            for candidate in sorted(reservations_dir.glob("*.json")):
+                try:
+                    data = json.loads(candidate.read_text(encoding="utf-8"))
+                except Exception:
+                    continue
+                records = data if isinstance(data, list) else [data]
+                for record in records:
+                    lines.append(json.dumps(record, sort_keys=True))
+        tmp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+        tmp_path.write_text(("\n".join(lines) + "\n") if lines else "", encoding="utf-8")
+        tmp_path.replace(manifest_path)
+
+    await _to_thread(_rebuild)
+    return manifest_path
+
+
 async def write_file_reservation_record(archive: ProjectArchive, file_reservation: dict[str, object]) -> None:
     path_pattern = str(file_reservation.get("path_pattern") or file_reservation.get("path") or "").strip()
     if not path_pattern:
@@ -589,12 +659,16 @@ async def write_file_reservation_record(archive: ProjectArchive, file_reservatio
     digest = hashlib.sha1(path_pattern.encode("utf-8")).hexdigest()
     file_reservation_path = archive.root / "file_reservations" / f"{digest}.json"
     await _write_json(file_reservation_path, normalized_file_reservation)
+    manifest_path = await rebuild_file_reservation_manifest(archive)
     agent_name = str(normalized_file_reservation.get("agent", "unknown"))
     await _commit(
         archive.repo,
         archive.settings,
         f"file_reservation: {agent_name} {path_pattern}",
-        [file_reservation_path.relative_to(archive.repo_root).as_posix()],
+        [
+            file_reservation_path.relative_to(archive.repo_root).as_posix(),
+            manifest_path.relative_to(archive.repo_root).as_posix(),
+        ],
     )
 
 
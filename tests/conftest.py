@@ -1,12 +1,33 @@
+import asyncio
 import contextlib
-import gc
+import os
+import shutil
+import sys
 from pathlib import Path
 
+# Never run test loops in asyncio debug mode: it captures a ten-frame stack
+# on every future/task creation, which swamps the small awaits these tests
+# do. asyncio treats ANY non-empty value as truthy, so "0" would switch
+# debug on; the variable must be absent. Respect a real opt-in ("1" etc.).
+if os.environ.get("PYTHONASYNCIODEBUG") in ("", "0"):
+    os.environ.pop("PYTHONASYNCIODEBUG", None)
+
 import pytest
 
 from mcp_agent_mail.config import clear_settings_cache
 from mcp_agent_mail.db import reset_database_state
-from mcp_agent_mail.storage import clear_repo_cache
+from mcp_agent_mail.storage import _OPEN_REPOS, clear_repo_cache
+
+# Run the suite on uvloop where available: the libuv loop cuts per-await
+# scheduling overhead for the aiosqlite-heavy tests. Optional so the suite
+# still runs where uvloop is not installed (e.g. Windows).
+if sys.platform != "win32":
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
 @pytest.fixture
@@ -33,48 +54,16 @@ def isolated_env(tmp_path, monkeypatch):
         # Close all cached Repo objects first (prevents file handle leaks)
         clear_repo_cache()
 
-        # Suppress ResourceWarnings during cleanup since Python 3.14 warns about resources
-        # being cleaned up by GC, which is exactly what we want
-        import warnings
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=ResourceWarning)
-            try:
-                import time
-
-                from git import Repo
-
-                # Multiple GC passes to ensure full cleanup of any non-cached repos
-                for _ in range(2):
-                    gc.collect()
-                    # Close any Repo instances that might still be open
-                    for obj in gc.get_objects():
-                        if isinstance(obj, Repo):
-                            with contextlib.suppress(Exception):
-                                obj.close()
-
-                # Give subprocesses time to terminate
-                time.sleep(0.05)
-
-                # Final GC pass
-                gc.collect()
-            except Exception:
-                pass
-
-            # Force another GC to clean up any remaining references
-            gc.collect()
+        # Close any stragglers storage opened outside the cache. The WeakSet
+        # only ever holds Repo instances, so this replaces the old full-heap
+        # gc.get_objects() scan (O(live objects) per teardown) with O(repos).
+        for repo in list(_OPEN_REPOS):
+            with contextlib.suppress(Exception):
+                repo.close()
 
         clear_settings_cache()
         reset_database_state()
 
-        if db_path.exists():
+        with contextlib.suppress(FileNotFoundError):
             db_path.unlink()
-        storage_root = tmp_path / "storage"
-        if storage_root.exists():
-            for path in storage_root.rglob("*"):
-                if path.is_file():
-                    path.unlink()
-            for path in sorted(storage_root.rglob("*"), reverse=True):
-                if path.is_dir():
-                    path.rmdir()
-            if storage_root.exists():
-                storage_root.rmdir()
+        shutil.rmtree(tmp_path / "storage", ignore_errors=True)
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import json
 import os
+import re
 import subprocess
 from pathlib import Path
 
@@ -82,3 +84,37 @@ async def test_precommit_conflict_detected(isolated_env, tmp_path: Path):
     proc = _run_precommit(script_path, code_repo, agent_name="Alpha")
     assert proc.returncode == 1
     assert "Exclusive file_reservation conflicts detected" in (proc.stderr or "")
+
+
+@pytest.mark.asyncio
+async def test_precommit_conflict_detected_without_hookrt(isolated_env, tmp_path: Path):
+    # When the baked HOOKRT_PATH does not resolve (package moved or
+    # uninstalled), the hook must fall back to its inlined logic and still
+    # block conflicting staged changes.
+    settings = get_settings()
+    archive = await ensure_archive(settings, "backend")
+    script_text = render_precommit_script(archive)
+    missing_runtime = json.dumps(str(tmp_path / "missing" / "_hookrt.py"))
+    script_text, substitutions = re.subn(
+        r"^HOOKRT_PATH = .*$", f"HOOKRT_PATH = {missing_runtime}", script_text, count=1, flags=re.MULTILINE
+    )
+    assert substitutions == 1
+    script_path = tmp_path / "precommit.py"
+    script_path.write_text(script_text, encoding="utf-8")
+
+    await write_file_reservation_record(
+        archive,
+        {
+            "agent": "Beta",
+            "path_pattern": "src/app.py",
+        },
+    )
+
+    code_repo = tmp_path / "code"
+    code_repo.mkdir(parents=True, exist_ok=True)
+    _init_git_repo(code_repo)
+    _stage_file(code_repo, "src/app.py")
+
+    proc = _run_precommit(script_path, code_repo, agent_name="Alpha")
+    assert proc.returncode == 1
+    assert "Exclusive file_reservation conflicts detected" in (proc.stderr or "")
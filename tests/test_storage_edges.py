@@ -12,7 +12,7 @@ from fastmcp import Client
 
 from mcp_agent_mail.app import build_mcp_server
 from mcp_agent_mail.config import get_settings
-from mcp_agent_mail.storage import AsyncFileLock
+from mcp_agent_mail.storage import AsyncFileLock, ensure_archive, ensure_archives
 
 
 @pytest.mark.asyncio
@@ -123,3 +123,20 @@ async def test_async_file_lock_recovers_stale(tmp_path, monkeypatch):
     # Metadata should be cleaned up after release
     assert not metadata_path.exists()
     assert not lock_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_ensure_archives_batches_archive_root_setup(isolated_env):
+    settings = get_settings()
+    archives = await ensure_archives(settings, ["backend", "frontend", "backend"])
+    # Duplicate slugs collapse to one archive per project
+    assert sorted(archives) == ["backend", "frontend"]
+    assert all(archive.root.is_dir() for archive in archives.values())
+    # One archive-root resolution serves every slug: same repo_root and Repo
+    assert len({archive.repo_root for archive in archives.values()}) == 1
+    assert len({id(archive.repo) for archive in archives.values()}) == 1
+    # Re-running over an existing archive reuses it and matches the
+    # single-slug path
+    single = await ensure_archive(settings, "backend")
+    assert single.slug == archives["backend"].slug
+    assert single.root == archives["backend"].root